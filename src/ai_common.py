@@ -0,0 +1,134 @@
+import logging
+from typing import Callable, Dict, List, Optional
+from cache import CacheLayer
+from features import compute_features
+from utils import compact_ip_data, parse_analysis
+
+logger = logging.getLogger(__name__)
+
+# AI analyses depend on traffic metrics that change between captures, keep them for an hour
+ANALYSIS_TTL = 3600
+# Failed AI analyses are not retried for five minutes
+ANALYSIS_FAILURE_TTL = 300
+
+# One line per IP in batch prompts
+_BATCH_RECORD_TEMPLATE = (
+    "{number}. IP: {ip} | Info: {ip_text} | Total Events: {total_events} | "
+    "Connects: {connects} | Disconnects: {disconnects} | "
+    "Sends: {sends} ({send_bytes} bytes) | Receives: {receives} ({receive_bytes} bytes) | "
+    "Bytes/Event: {bytes_per_event} | Connect Ratio: {connect_ratio} | Send/Receive Asymmetry: {send_receive_asymmetry}"
+)
+
+
+def analysis_key(ip_data: Optional[Dict] = None, ip: Optional[str] = None, **metrics) -> tuple:
+    """
+    Build the cache key parts for an AI analysis call.
+
+    The ip-api details are left out since they are determined by the IP.
+    Metrics are rounded (event counts to tens, byte counts to KiB) so small
+    differences between captures of the same host still hit the cache.
+    """
+    signature = tuple(
+        (name, None if value is None else int(value) // (1024 if name.endswith('bytes') else 10))
+        for name, value in sorted(metrics.items())
+    )
+    return (ip, signature)
+
+
+def prompt_fields(record: Dict) -> Dict:
+    """
+    Build the prompt template fields for an analysis request.
+
+    Args:
+        record: Analysis request with ip, ip_data and event metrics
+
+    Returns:
+        The record with the compact ip-api details as ip_text and the derived traffic features added
+    """
+    return dict(record, ip_text=compact_ip_data(record.get('ip_data')), **compute_features(**record))
+
+
+def format_batch_records(records: List[Dict]) -> str:
+    """Render analysis requests as numbered lines for a batch prompt."""
+    return '\n'.join(
+        _BATCH_RECORD_TEMPLATE.format_map(dict(prompt_fields(record), number=number))
+        for number, record in enumerate(records, 1)
+    )
+
+
+def analyze_record(record: Dict, template: str, generate: Callable[[str], str]) -> Optional[Dict[str, str]]:
+    """
+    Analyze a single IP with an AI model.
+
+    Args:
+        record: Analysis request with ip, ip_data and event metrics
+        template: Prompt template filled with prompt_fields
+        generate: Sends a prompt to the model and returns the response text
+
+    Returns:
+        Parsed analysis fields or None if the request failed
+    """
+    try:
+        analysis = generate(template.format_map(prompt_fields(record)))
+        logger.debug("Analysis for %s: %s", record['ip'], analysis)
+        return parse_analysis(analysis)
+    except Exception as e:
+        logger.error("Error analyzing IP %s: %s", record['ip'], e)
+        return None
+
+
+def cached_batch(cache: Optional[CacheLayer], service: str, records: List[Dict],
+                 analyze_batch: Callable[[List[Dict]], Dict[str, Dict]], analyze_one: Callable[[Dict], Optional[Dict]],
+                 ttl: float = ANALYSIS_TTL, key_func: Callable = analysis_key,
+                 failure_ttl: Optional[float] = ANALYSIS_FAILURE_TTL) -> List[Optional[Dict]]:
+    """
+    Analyze several IPs with a single AI request, caching results like `cached`.
+
+    Fresh entries are served from the cache and requests that failed within
+    failure_ttl get their stale entry. The rest are sent together, and any
+    request missing from the batch result falls back to analyze_one.
+
+    Args:
+        cache: Response cache, or None to always call the model
+        service: Name of the AI service, used as key prefix
+        records: Analysis requests, one dictionary per IP
+        analyze_batch: Sends several records at once and returns results keyed by IP
+        analyze_one: Sends a single record without caching, returns None on failure
+        ttl: Time in seconds a cached result stays fresh
+        key_func: Builds the key parts from a record
+        failure_ttl: If set, a failed request is not repeated for this many seconds
+
+    Returns:
+        List of results in the same order as records
+    """
+    results = [None] * len(records)
+    keys = [cache.make_key(service, key_func(**record)) if cache else None for record in records]
+    pending = []
+    for i, key in enumerate(keys):
+        if key is not None:
+            results[i] = cache.get(key, ttl)
+            if results[i] is not None:
+                continue
+            if failure_ttl and cache.recently_failed(key):
+                results[i] = cache.get(key, ttl, allow_stale=True)
+                continue
+        pending.append(i)
+
+    if len(pending) > 1:
+        try:
+            analyses = analyze_batch([records[i] for i in pending])
+        except Exception as e:
+            logger.error(f"Error analyzing batch of {len(pending)} IPs with {service}: {str(e)}")
+            analyses = {}
+        for i in pending:
+            results[i] = analyses.get(records[i]['ip'])
+            if results[i] is not None and cache:
+                cache.set(keys[i], results[i])
+
+    # Fall back to one request per record for anything the batch did not cover
+    for i in pending:
+        if results[i] is None:
+            value = analyze_one(records[i])
+            results[i] = cache.store_result(keys[i], value, ttl, failure_ttl) if cache else value
+
+    return results
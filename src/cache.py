@@ -0,0 +1,155 @@
+import functools
+import hashlib
+import logging
+import threading
+import time
+import diskcache
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class CacheLayer:
+    def __init__(self, cache_dir: str = "data/cache"):
+        """
+        Initialize the on-disk response cache.
+
+        Args:
+            cache_dir: Directory path for the cache files
+        """
+        self.cache = diskcache.Cache(cache_dir)
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.lock = threading.Lock()
+
+    def make_key(self, service: str, *parts) -> str:
+        """
+        Build a cache key for a service call.
+
+        Args:
+            service: Name of the upstream service
+            parts: Values identifying the call (IP, parameters)
+
+        Returns:
+            Key of the form 'service:sha1'
+        """
+        digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+        return f"{service}:{digest}"
+
+    def get(self, key: str, ttl: float, allow_stale: bool = False) -> Optional[Any]:
+        """
+        Look up a cached value.
+
+        Args:
+            key: Cache key from make_key
+            ttl: Maximum age in seconds for the entry to count as fresh
+            allow_stale: Return the entry even if it is older than ttl
+
+        Returns:
+            Cached value or None if missing or expired
+        """
+        entry = self.cache.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            if time.time() - stored_at < ttl:
+                self._count('hits')
+                return value
+            if allow_stale:
+                self._count('stale_hits')
+                return value
+        if not allow_stale:
+            self._count('misses')
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a value in the cache.
+
+        Entries are kept past their TTL so they can be served as a fallback
+        when the upstream service fails.
+
+        Args:
+            key: Cache key from make_key
+            value: Value to store
+        """
+        self.cache.set(key, (time.time(), value))
+
+    def store_result(self, key: str, value: Any, ttl: float, failure_ttl: Optional[float] = None) -> Any:
+        """
+        Store the result of an upstream call, or handle its failure.
+
+        Args:
+            key: Cache key from make_key
+            value: Result of the call, None if it failed
+            ttl: Time in seconds a cached result stays fresh
+            failure_ttl: If set, a failure is recorded for this many seconds
+
+        Returns:
+            The value, or the last known entry (possibly None) if the call failed
+        """
+        if value is not None:
+            self.set(key, value)
+            return value
+        if failure_ttl:
+            self.mark_failed(key, failure_ttl)
+
+        stale = self.get(key, ttl, allow_stale=True)
+        if stale is not None:
+            logger.warning(f"Serving stale {key.split(':', 1)[0]} entry after upstream failure")
+        return stale
+
+    def mark_failed(self, key: str, ttl: float) -> None:
+        """Record that the upstream call for a key just failed, for ttl seconds."""
+        self.cache.set(f"{key}:failed", time.time(), expire=ttl)
+
+    def recently_failed(self, key: str) -> bool:
+        """Check whether the upstream call for a key failed and its failure marker has not expired."""
+        return f"{key}:failed" in self.cache
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters."""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'stale_hits': self.stale_hits}
+
+    def close(self) -> None:
+        """Close the underlying cache files."""
+        self.cache.close()
+
+    def _count(self, counter: str) -> None:
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+def cached(service: str, ttl: float, key_func: Optional[Callable] = None, failure_ttl: Optional[float] = None):
+    """
+    Cache the result of a client method in the client's `cache` attribute.
+
+    Results of None (failed upstream calls) are not stored; instead the last
+    known entry is served, even if it has expired.
+
+    Args:
+        service: Name of the upstream service, used as key prefix
+        ttl: Time in seconds a cached result stays fresh
+        key_func: Builds the key parts from the call arguments. Defaults to
+            all positional and keyword arguments.
+        failure_ttl: If set, a failed call is not repeated for this many
+            seconds and the stale entry (or None) is returned instead
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, 'cache', None)
+            if cache is None:
+                return func(self, *args, **kwargs)
+
+            parts = key_func(*args, **kwargs) if key_func else (args, sorted(kwargs.items()))
+            key = cache.make_key(service, parts)
+            value = cache.get(key, ttl)
+            if value is not None:
+                return value
+            if failure_ttl and cache.recently_failed(key):
+                return cache.get(key, ttl, allow_stale=True)
+
+            return cache.store_result(key, func(self, *args, **kwargs), ttl, failure_ttl)
+        return wrapper
+    return decorator
@@ -1,31 +1,28 @@
 import os
 from dotenv import load_dotenv
 import logging
+from functools import lru_cache
 from typing import Dict, Optional
 
-class ConfigHandler:
-    def __init__(self):
-        self.logger = logging.getLogger('ConfigHandler')
-        self._load_environment()
+logger = logging.getLogger(__name__)
 
-    def _load_environment(self) -> None:
-        """Load environment variables from .env file."""
-        # Try to load from .env file
-        if os.path.exists('.env'):
-            load_dotenv()
-        else:
-            self.logger.warning(".env file not found. Falling back to environment variables.")
+@lru_cache(maxsize=1)
+def get_credentials() -> Optional[Dict[str, str]]:
+    """
+    Get API credentials, loading the .env file on first use.
+    
+    Returns:
+        Dictionary containing API credentials or None if missing credentials
+    """
+    # Try to load from .env file
+    if os.path.exists('.env'):
+        load_dotenv()
+    else:
+        logger.warning(".env file not found. Falling back to environment variables.")
 
-    def get_credentials(self) -> Optional[Dict[str, str]]:
-        """
-        Get API credentials from environment variables.
-        
-        Returns:
-            Dictionary containing API credentials or None if missing credentials
-        """
-        required_vars = {
-            'GEMINI_API_KEY' : os.getenv('GEMINI_API_KEY'),
-            'TOGETHER_API_KEY': os.getenv('TOGETHER_API_KEY')
-        }
+    required_vars = {
+        'GEMINI_API_KEY' : os.getenv('GEMINI_API_KEY'),
+        'TOGETHER_API_KEY': os.getenv('TOGETHER_API_KEY')
+    }
 
-        return required_vars
\ No newline at end of file
+    return required_vars
\ No newline at end of file
@@ -3,6 +3,20 @@ import logging
 from pathlib import Path
 from typing import List, Dict
 from datetime import datetime
+from utils import aggregate_network_records
+
+logger = logging.getLogger(__name__)
+
+# Procmon network summary columns summed per IP, in record order
+METRIC_COLUMNS = ('Total Events', 'Connects', 'Disconnects', 'Sends', 'Receives', 'Send Bytes', 'Receive Bytes')
+
+# Columns of the analysis output, keys not listed here are dropped
+FIELDNAMES = (
+    'ip', 'total events', 'connects', 'disconnects', 'sends', 'receives', 'send bytes', 'received bytes',
+    'country', 'organisation', 'isp', 'classification',
+    'trustworthiness', 'primary_purpose', 'security_concerns', 'risk score', 'recommendation',
+    'error'
+)
 
 class CSVHandler:
     def __init__(self, input_dir: str = "data/input", output_dir: str = "data/output"):
@@ -15,45 +29,44 @@ class CSVHandler:
         """
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
-        self.setup_logging()
         self.ensure_directories()
 
-    def setup_logging(self):
-        """Configure logging for the CSV handler."""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        self.logger = logging.getLogger('CSVHandler')
-
     def ensure_directories(self):
         """Create input and output directories if they don't exist."""
         self.input_dir.mkdir(parents=True, exist_ok=True)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
-    def read_network_summary(self, filename: str) -> List[str]:
+    def read_network_summary(self, filename: str) -> List[List]:
         """
         Read IP addresses from a CSV file.
+
+        Rows for the same IP are merged and their event metrics summed, so
+        each unique IP is only sent to the APIs once.
         
         Args:
             filename: Name of the CSV file in the input directory
             
         Returns:
-            List of IP addresses
+            List of [ip, total_events, connects, disconnects, sends, receives, send_bytes, receive_bytes]
         """
         file_path = self.input_dir / filename
-        summary_list = []
+        network_records = []
         
         try:
             with open(file_path, 'r', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                # Check if 'ip' column exists
-                if 'Path' not in reader.fieldnames:
-                    raise ValueError("CSV file must contain 'Path' column")
-                
-                
+                reader = csv.reader(csvfile)
+                header = next(reader, [])
+                # Check if 'Path' and metric columns exist
+                missing = [name for name in ('Path',) + METRIC_COLUMNS if name not in header]
+                if missing:
+                    raise ValueError(f"CSV file must contain {', '.join(missing)} column(s)")
+
+                path_index = header.index('Path')
+                metric_indexes = [header.index(name) for name in METRIC_COLUMNS]
+                to_int = self._to_int
+
                 for row in reader:
-                    ip = row['Path'].strip()
+                    ip = row[path_index].strip()
                     if not ip:
                         continue
                     if "." not in ip:
@@ -61,22 +74,22 @@ class CSVHandler:
                     if ":" in ip:
                         colon_index = ip.index(":")
                         ip = ip[:colon_index]
-                    total_events = row['Total Events']
-                    connects = row['Connects']
-                    disconnects = row['Disconnects']
-                    sends = row['Sends']
-                    receives = row['Receives']
-                    send_bytes = row['Send Bytes']
-                    recieve_bytes = row['Receive Bytes']
-                    summary_list.append([ip, total_events, connects, disconnects, sends, receives, send_bytes, recieve_bytes])
-                
-            self.logger.info(f"Successfully read {len(summary_list)} IPs from {filename}")
+                    network_records.append([ip] + [to_int(row[i]) for i in metric_indexes])
+
+            summary_list = aggregate_network_records(network_records)
+            logger.info(f"Successfully read {len(summary_list)} unique IPs ({len(network_records)} rows) from {filename}")
             return summary_list
             
         except Exception as e:
-            self.logger.error(f"Error reading IP list from {filename}: {str(e)}")
+            logger.error(f"Error reading IP list from {filename}: {str(e)}")
             raise
 
+    @staticmethod
+    def _to_int(value: str) -> int:
+        """Parse a Procmon counter, which may contain thousands separators."""
+        value = (value or '').replace(',', '').strip()
+        return int(value) if value else 0
+
     def write_analysis_results(self, results: List[Dict]) -> str:
         """
         Write analysis results to a CSV file.
@@ -92,32 +105,23 @@ class CSVHandler:
         output_path = self.output_dir / output_filename
 
         try:
-            # Get all unique fields from all results
-            fieldnames = set()
-            for result in results:
-                fieldnames.update(result.keys())
-            
-            # Convert sets or lists in results to strings for CSV writing
-            processed_results = []
-            for result in results:
-                processed_result = {}
-                for key, value in result.items():
-                    if isinstance(value, (list, set)):
-                        processed_result[key] = ', '.join(map(str, value))
-                    else:
-                        processed_result[key] = value
-                processed_results.append(processed_result)
+            # Convert sets or lists in results to strings while writing
+            processed_results = (
+                {key: ', '.join(map(str, value)) if isinstance(value, (list, set)) else value
+                 for key, value in result.items()}
+                for result in results
+            )
 
             with open(output_path, 'w', newline='') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=sorted(fieldnames))
+                writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES, extrasaction='ignore')
                 writer.writeheader()
                 writer.writerows(processed_results)
 
-            self.logger.info(f"Successfully wrote analysis results to {output_filename}")
+            logger.info(f"Successfully wrote analysis results to {output_filename}")
             return str(output_path)
 
         except Exception as e:
-            self.logger.error(f"Error writing analysis results: {str(e)}")
+            logger.error(f"Error writing analysis results: {str(e)}")
             raise
 
     def get_input_file_list(self) -> List[str]:
@@ -0,0 +1,30 @@
+from typing import Any, Dict, Optional, Union
+
+def compute_features(total_events: Optional[int] = None, connects: Optional[int] = None, disconnects: Optional[int] = None,
+                     sends: Optional[int] = None, receives: Optional[int] = None, send_bytes: Optional[int] = None,
+                     receive_bytes: Optional[int] = None, **_: Any) -> Dict[str, Union[float, str]]:
+    """
+    Derive traffic ratios from the event metrics of one IP.
+
+    These are passed to the AI model so it does not have to infer them.
+    Other keyword arguments, such as ip and ip_data, are ignored so an
+    analysis request can be passed as is. Metrics may be numeric
+    strings, as read from the CSV.
+
+    Returns:
+        Dictionary with bytes_per_event, connect_ratio (connects per
+        disconnect, 'n/a' without disconnects) and send_receive_asymmetry
+        (-1 receive only to 1 send only)
+    """
+    total_events = int(total_events or 0)
+    connects = int(connects or 0)
+    disconnects = int(disconnects or 0)
+    send_bytes = int(send_bytes or 0)
+    receive_bytes = int(receive_bytes or 0)
+    total_bytes = send_bytes + receive_bytes
+
+    return {
+        'bytes_per_event': round(total_bytes / total_events, 2) if total_events else 0.0,
+        'connect_ratio': round(connects / disconnects, 2) if disconnects else 'n/a',
+        'send_receive_asymmetry': round((send_bytes - receive_bytes) / total_bytes, 2) if total_bytes else 0.0
+    }
@@ -1,158 +1,189 @@
+import json
 import logging
+from functools import lru_cache
 import google.generativeai as genai
-from typing import Dict, Optional
+from google.api_core import exceptions as google_exceptions
+from typing import Dict, List, Optional
+from rate_limiter import TokenBucket, retry_with_backoff
+from cache import CacheLayer
+from ai_common import analyze_record, cached_batch, format_batch_records
+from utils import FIELD_MAP, MAX_TOKENS_PER_IP
+
+logger = logging.getLogger(__name__)
+
+# IPs per request; JSON mode keeps larger batches parseable
+BATCH_SIZE = 20
+
+_PROMPT_TEMPLATE = """
+You are an expert Cybersecurity Analyst specializing in network behavior analysis and threat detection.
+
+INPUT DATA:
+- Full IP Information in JSON: {ip_text}
+- IP Address: {ip}
+- Event Metrics:
+* Total Events: {total_events}
+* Connection Events: {connects} connects | {disconnects} disconnects
+* Data Transfer: {sends} sends ({send_bytes} bytes) | {receives} receives ({receive_bytes} bytes)
+* Derived: {bytes_per_event} bytes per event | {connect_ratio} connects per disconnect | {send_receive_asymmetry} send/receive asymmetry (-1 receive only, 1 send only)
+
+ANALYSIS REQUIREMENTS:
+Provide a security assessment in the following strict format:
+IP: {ip}
+Trustworthiness: <insert score 1-100>
+Primary Purpose: <single line description maximum 20 words. no special characters><.>
+Security Concerns: <start with YES or NO><.><space><insert explanation maximum 15 words no special characters><.>
+Risk Score: <insert score 1-100>
+Recommendation: <start with either 'No action required' or 'Requires Attention'><.><space><if attention needed add maximum 20 words no special characters><.>
+
+CRITICAL FORMAT RULES:
+1. Do not use any commas periods or special characters
+2. Each field must be on a new line
+3. Use exact field names as shown above
+4. Keep all responses within specified word limits
+5. Maintain consistent capitalization of field names
+6. Use hyphens instead of commas or periods for separation
+7. Ensure each field has exactly one colon followed by a space
+8. Do not include any additional formatting or explanations
+
+ANALYSIS GUIDELINES:
+- Base Trustworthiness score on:
+* Known IP reputation
+* Organisaton and ISP result
+* Communication patterns
+* Data volume ratios
+* Connection frequency
+- Consider these risk factors:
+* Unusual port usage
+* Asymmetric data transfer
+* Connection pattern anomalies
+* Geographic location concerns
+
+Your response must be directly parseable by the following format indicators:
+- Line starts with field name followed by colon
+- Single space after colon
+- No line breaks within fields
+- No extra whitespace
+- No additional formatting
+"""
+
+_BATCH_PROMPT_TEMPLATE = """
+You are an expert Cybersecurity Analyst specializing in network behavior analysis and threat detection.
+
+INPUT DATA:
+{count} IP addresses, one per line, with their IP information in JSON and event metrics:
+{records}
+
+ANALYSIS REQUIREMENTS:
+Respond with a JSON array containing exactly one object per IP address above, in the same order.
+Each object must have these keys:
+- "ip": the IP address
+- "trustworthiness": score 1-100
+- "primary_purpose": single line description maximum 20 words
+- "security_concerns": start with YES or NO followed by an explanation of maximum 15 words
+- "risk_score": score 1-100
+- "recommendation": start with either 'No action required' or 'Requires Attention' followed by maximum 20 words if attention is needed
+
+Do not use commas in the text values. Do not include anything outside the JSON array.
+
+ANALYSIS GUIDELINES:
+- Base Trustworthiness score on:
+* Known IP reputation
+* Organisaton and ISP result
+* Communication patterns
+* Data volume ratios
+* Connection frequency
+- Consider these risk factors:
+* Unusual port usage
+* Asymmetric data transfer
+* Connection pattern anomalies
+* Geographic location concerns
+"""
+
+# Keys of the JSON batch response mapped to result keys, e.g. 'risk_score' to 'risk score'
+_BATCH_FIELDS = {label.replace(' ', '_'): field for label, field in FIELD_MAP.items()}
+
+@lru_cache(maxsize=4)
+def _get_model(api_key: str, model_name: str) -> genai.GenerativeModel:
+    """Create the Gemini model once per API key so it is reused across clients."""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
 
 class GeminiClient:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache: Optional[CacheLayer] = None):
         """
         Initialize Gemini AI client.
         
         Args:
             api_key: Gemini API key
+            cache: Optional response cache
         """
         self.api_key = api_key
+        self.cache = cache
         self.client = None
         self.modle = None
-        self.setup_logging()
-
-
-    def setup_logging(self):
-        """Configure logging for the Gemini client."""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        self.logger = logging.getLogger('GeminiClient')
+        # Gemini 1.5 Flash free tier allows 15 requests per minute
+        self.rate_limiter = TokenBucket.per_minute(15)
 
     def connect(self) -> bool:
         """Establish connection to Gemini API."""
         try:
-            
-            genai.configure(api_key=self.api_key)
-            self.modle = genai.GenerativeModel("gemini-1.5-flash")
+            self.modle = _get_model(self.api_key, "gemini-1.5-flash")
             return True
         except Exception as e:
-            self.logger.error(f"Failed to connect to Gemini API: {str(e)}")
+            logger.error(f"Failed to connect to Gemini API: {str(e)}")
             return False
 
-    def analyze_ip_data(self, ip_data: Dict, ip, total_events: int = None, connects: int = None, disconnects: int = None, sends: int = None, receives: int = None, send_bytes: int = None, receive_bytes: int = None) -> Optional[Dict]:
+    def analyze_ip_batch(self, records: List[Dict]) -> List[Optional[Dict]]:
         """
-        Analyze IP data using Gemini AI.
-        
+        Analyze several IPs with a single Gemini request.
+
         Args:
-            ip_data: Dictionary containing IP information from Censys
-            
+            records: Analysis requests (ip, ip_data and event metrics), one dictionary per IP
+
         Returns:
-            Dictionary containing AI analysis results
+            List of AI analysis results in the same order as records
         """
-        try:
-            # Format the IP data for analysis
-            ip_text = ip_data.__str__()
-            prompt = f"""
-            You are an expert Cybersecurity Analyst specializing in network behavior analysis and threat detection.
-            
-            INPUT DATA:
-            - Full IP Information in JSON: {ip_text}
-            - IP Address: {ip}
-            - Event Metrics:
-            * Total Events: {total_events}
-            * Connection Events: {connects} connects | {disconnects} disconnects
-            * Data Transfer: {sends} sends ({send_bytes} bytes) | {receives} receives ({receive_bytes} bytes)
-
-            ANALYSIS REQUIREMENTS:
-            Provide a security assessment in the following strict format:
-            IP: {ip}
-            Trustworthiness: <insert score 1-100>
-            Primary Purpose: <single line description maximum 20 words. no special characters><.>
-            Security Concerns: <start with YES or NO><.><space><insert explanation maximum 15 words no special characters><.>
-            Risk Score: <insert score 1-100>
-            Recommendation: <start with either 'No action required' or 'Requires Attention'><.><space><if attention needed add maximum 20 words no special characters><.>
-
-            CRITICAL FORMAT RULES:
-            1. Do not use any commas periods or special characters
-            2. Each field must be on a new line
-            3. Use exact field names as shown above
-            4. Keep all responses within specified word limits
-            5. Maintain consistent capitalization of field names
-            6. Use hyphens instead of commas or periods for separation
-            7. Ensure each field has exactly one colon followed by a space
-            8. Do not include any additional formatting or explanations
-
-            ANALYSIS GUIDELINES:
-            - Base Trustworthiness score on:
-            * Known IP reputation
-            * Organisaton and ISP result
-            * Communication patterns
-            * Data volume ratios
-            * Connection frequency
-            - Consider these risk factors:
-            * Unusual port usage
-            * Asymmetric data transfer
-            * Connection pattern anomalies
-            * Geographic location concerns
-
-            Your response must be directly parseable by the following format indicators:
-            - Line starts with field name followed by colon
-            - Single space after colon
-            - No line breaks within fields
-            - No extra whitespace
-            - No additional formatting
-            """
-            response = self.modle.generate_content(prompt)
-            analysis = response.text
-            print(analysis)
-
-            # Parse the analysis into structured fields
-            analysis_dict = self._parse_analysis(analysis)
-        
+        return cached_batch(self.cache, "gemini", records, self._analyze_batch, self._analyze_record)
 
-            return analysis_dict
+    def _analyze_record(self, record: Dict) -> Optional[Dict]:
+        """Analyze one IP without the cache."""
+        return analyze_record(record, _PROMPT_TEMPLATE, self._generate)
 
-        except Exception as e:
-            self.logger.error(f"Error analyzing IP {ip_data['ip']}: {str(e)}")
-            return None
+    def _analyze_batch(self, records: List[Dict]) -> Dict[str, Dict]:
+        """
+        Send several IPs in one request and parse the JSON array response.
+
+        Objects missing a field are dropped so those IPs fall back to a single-IP request.
 
-    def _parse_analysis(self, analysis: str) -> Dict:
+        Returns:
+            Dictionary mapping each IP to its analysis fields
         """
-        Parse Gemini's analysis into structured fields.
-        
+        prompt = _BATCH_PROMPT_TEMPLATE.format_map({'count': len(records), 'records': format_batch_records(records)})
+        analysis = self._generate(prompt, max_output_tokens=MAX_TOKENS_PER_IP * len(records), response_mime_type='application/json')
+        logger.debug("Gemini batch analysis: %s", analysis)
+
+        analyses = {}
+        for item in json.loads(analysis):
+            if isinstance(item, dict) and all(item.get(key) not in (None, '') for key in _BATCH_FIELDS):
+                analyses[str(item.get('ip'))] = {field: str(item[key]) for key, field in _BATCH_FIELDS.items()}
+        return analyses
+
+    @retry_with_backoff((google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable,
+                         google_exceptions.InternalServerError, google_exceptions.DeadlineExceeded))
+    def _generate(self, prompt: str, max_output_tokens: int = MAX_TOKENS_PER_IP, response_mime_type: Optional[str] = None) -> str:
+        """
+        Send a prompt to Gemini, retrying on rate limits and transient errors.
+
+        Sampling is greedy so identical inputs give identical, cacheable output.
+
         Args:
-            analysis: Raw analysis text from Gemini
-            
-        Returns:
-            Dictionary containing parsed analysis fields
+            prompt: Full prompt text
+            max_output_tokens: Maximum number of tokens to generate
+            response_mime_type: Optional response format, e.g. 'application/json'
         """
-        # Initialize default values
-        parsed = {
-            'trustworthiness': '',
-            'primary_purpose': '',
-            'security_concerns': '',
-            'risk score': '',
-            'recommendation': ''
-        }
-
-        # Simple parsing based on field markers
-        current_field = None
-        for line in analysis.split('\n'):
-            line = line.strip()
-            lower_line = line.lower()
-
-            if 'trustworthiness' in lower_line and ':' in line:
-                current_field = 'trustworthiness'
-                parsed[current_field] = line.split(':', 1)[1].strip()
-            elif 'primary purpose' in lower_line and ':' in line:
-                current_field = 'primary_purpose'
-                parsed[current_field] = line.split(':', 1)[1].strip()
-            elif 'security concerns' in lower_line and ':' in line:
-                current_field = 'security_concerns'
-                parsed[current_field] = line.split(':', 1)[1].strip()
-            elif 'risk score' in lower_line and ':' in line:
-                current_field = 'risk score'
-                parsed[current_field] = line.split(':', 1)[1].strip()
-            elif 'recommendation' in lower_line and ':' in line:
-                current_field = 'recommendation'
-                parsed[current_field] = line.split(':', 1)[1].strip()
-            elif current_field and line:
-                parsed[current_field] += ' ' + line
-
-        return parsed
\ No newline at end of file
+        generation_config = {'temperature': 0.0, 'max_output_tokens': max_output_tokens}
+        if response_mime_type:
+            generation_config['response_mime_type'] = response_mime_type
+        self.rate_limiter.acquire()
+        response = self.modle.generate_content(prompt, generation_config=generation_config)
+        return response.text
\ No newline at end of file
@@ -2,37 +2,154 @@
 
 import requests
 import logging
-from typing import Dict, Optional
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Callable, Dict, List, Optional
+from rate_limiter import TokenBucket
+from cache import CacheLayer, cached
 
-class IPClient:
-    def __init__(self):
-        """Initialize Censys API client."""
-        self.setup_logging()
+logger = logging.getLogger(__name__)
+
+# Geolocation data rarely changes, keep it for a week
+IP_API_TTL = 604800
+# ip-api.com accepts at most 100 IPs per batch request
+BATCH_SIZE = 100
+# Attempts per request when ip-api.com answers 429 Too Many Requests
+RATE_LIMIT_ATTEMPTS = 3
+
+def create_session(pool_maxsize: int) -> requests.Session:
+    """
+    Create a requests session with a keep-alive connection pool and retries.
 
-    def setup_logging(self):
-        """Configure logging for the IP client."""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        self.logger = logging.getLogger('IPClient')
+    Args:
+        pool_maxsize: Maximum number of pooled connections per host
 
+    Returns:
+        Configured requests session
+    """
+    session = requests.Session()
+    # Exponential backoff with jitter, honouring Retry-After on 503. 429 is
+    # left to IPClient so retries go back through the rate limiter.
+    retries = Retry(
+        total=5,
+        backoff_factor=0.5,
+        backoff_max=30,
+        backoff_jitter=1.0,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=None
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class IPClient:
+    def __init__(self, max_workers: int = 3, cache: Optional[CacheLayer] = None, session: Optional[requests.Session] = None):
+        """
+        Initialize ip-api.com client.
+
+        Args:
+            max_workers: Number of worker threads sharing the connection pool
+            cache: Optional response cache
+            session: Shared requests session, a new one is created if omitted
+        """
+        self.cache = cache
+        self.session = session or create_session(pool_maxsize=max_workers)
+        # ip-api.com free tier allows 45 requests per minute, 15 for the batch endpoint
+        self.rate_limiter = TokenBucket.per_minute(45)
+        self.batch_rate_limiter = TokenBucket.per_minute(15)
 
+    @cached("ip-api", ttl=IP_API_TTL, key_func=lambda ip_address: (ip_address,))
     def get_ip_details(self, ip_address: str) -> Optional[Dict]:
         """
-        Query Censys API for IP address details.
-        
+        Query ip-api.com for IP address details.
+
         Args:
             ip_address: IP address to query
-            
+
         Returns:
             Dictionary containing IP details or None if query fails
         """
         try:
-            response = requests.get(f"http://ip-api.com/json/{ip_address}")
+            response = self._send(self.rate_limiter, lambda: self.session.get(f"http://ip-api.com/json/{ip_address}", timeout=(3, 10)))
             response.raise_for_status()  # Raise an exception for non-2xx status codes
             return response.json()
 
         except Exception as e:
-            self.logger.error(f"Error querying IP {ip_address}: {str(e)}")
-            return None
\ No newline at end of file
+            logger.error(f"Error querying IP {ip_address}: {str(e)}")
+            return None
+
+    def get_ip_details_batch(self, ips: List[str]) -> Dict[str, Dict]:
+        """
+        Query ip-api.com for up to 100 IP addresses in a single request.
+
+        Cached IPs are served from the cache and only the rest are queried.
+
+        Args:
+            ips: IP addresses to query
+
+        Returns:
+            Dictionary mapping each IP to its details. IPs are missing if the
+            batch request failed.
+        """
+        details = {}
+        missing = []
+        for ip in ips[:BATCH_SIZE]:
+            record = self.cache.get(self.cache.make_key("ip-api", (ip,)), IP_API_TTL) if self.cache else None
+            if record is not None:
+                details[ip] = record
+            else:
+                missing.append(ip)
+
+        if not missing:
+            return details
+
+        try:
+            response = self._send(self.batch_rate_limiter, lambda: self.session.post(
+                "http://ip-api.com/batch",
+                json=[{"query": ip} for ip in missing],
+                timeout=(3, 10)
+            ))
+            response.raise_for_status()
+            for record in response.json():
+                ip = record.get("query")
+                details[ip] = record
+                if self.cache and record.get("status") == "success":
+                    self.cache.set(self.cache.make_key("ip-api", (ip,)), record)
+
+        except Exception as e:
+            logger.error(f"Error querying batch of {len(missing)} IPs: {str(e)}")
+            if self.cache:
+                for ip in missing:
+                    record = self.cache.get(self.cache.make_key("ip-api", (ip,)), IP_API_TTL, allow_stale=True)
+                    if record is not None:
+                        details[ip] = record
+
+        return details
+
+    def _send(self, rate_limiter: TokenBucket, request: Callable[[], requests.Response]) -> requests.Response:
+        """
+        Send a request through a rate limiter, waiting out 429 responses.
+
+        ip-api.com sends no Retry-After header; X-Ttl holds the seconds until
+        its rate limit window resets. Each retry acquires a new token.
+
+        Args:
+            rate_limiter: Token bucket of the endpoint
+            request: Sends the request and returns the response
+
+        Returns:
+            Last response, which may still be a 429
+        """
+        for attempt in range(1, RATE_LIMIT_ATTEMPTS + 1):
+            rate_limiter.acquire()
+            response = request()
+            if response.status_code != 429 or attempt == RATE_LIMIT_ATTEMPTS:
+                return response
+            try:
+                wait = float(response.headers.get('X-Ttl', 60))
+            except ValueError:
+                wait = 60
+            logger.warning(f"ip-api.com rate limit reached, waiting {wait:.0f}s")
+            time.sleep(wait)
@@ -1,120 +1,193 @@
+import ipaddress
 import logging
-from typing import List, Dict
-from ip_client import IPClient
+import re
+from typing import List, Dict, Optional
+from ip_client import IPClient, BATCH_SIZE, create_session
 from csv_handler import CSVHandler
-from togehter_client import TogetherClient
-from gemini_client import GeminiClient
-from config import ConfigHandler
-import time
+from togehter_client import TogetherClient, BATCH_SIZE as TOGETHER_BATCH_SIZE
+from gemini_client import GeminiClient, BATCH_SIZE as GEMINI_BATCH_SIZE
+from config import get_credentials
+from cache import CacheLayer
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from utils import progress_tracker
+from utils import aggregate_network_records, progress_tracker, chunked
+
+logger = logging.getLogger(__name__)
+
+# Workers mostly wait on network I/O; the per-API token buckets enforce the rate limits
+MAX_WORKERS = 16
+
+# Analysis request keys for the AI clients, in network record order
+_ANALYSIS_ARGS = ("ip", "total_events", "connects", "disconnects", "sends", "receives", "send_bytes", "receive_bytes")
+# Output columns of the network metrics, in network record order
+_FIELDS = ("ip", "total events", "connects", "disconnects", "sends", "receives", "send bytes", "received bytes")
+
+# Procmon resolves addresses by default, so Path often holds a host name.
+# ip-api.com resolves these itself; the top-level label must not be numeric.
+_HOSTNAME_RE = re.compile(r'(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.?')
+
+def _base_dict(network_record: List) -> Dict:
+    """Map a network record to its output columns."""
+    return dict(zip(_FIELDS, network_record))
+
 class IPIntelAnalyzer:
-    def __init__(self, use:str):
+    def __init__(self, use:str, max_workers: int = MAX_WORKERS, ai_batch_size: Optional[int] = None):
         """Initialize the IP Intelligence Analyzer."""
-        self.setup_logging()
-        self.config_handler = ConfigHandler()
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.closed = False
+        self.session = create_session(pool_maxsize=max_workers * 2)
         self.use_gemini_ai = False if use == "together" else True
         self.user_together_ai = False if use == "gemini" else True
+        # Number of IPs sent to the AI model in a single request
+        self.ai_batch_size = ai_batch_size or (GEMINI_BATCH_SIZE if self.use_gemini_ai else TOGETHER_BATCH_SIZE)
         self.initialize_clients()
 
-    def setup_logging(self):
-        """Configure logging for the main program."""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        self.logger = logging.getLogger('IPIntelAnalyzer')
-
     def initialize_clients(self) -> bool:
         """Initialize all API clients."""
-        credentials = self.config_handler.get_credentials()
+        credentials = get_credentials()
         if not credentials:
-            self.logger.error("Failed to load API credentials")
+            logger.error("Failed to load API credentials")
             return False
 
-        self.ip_client = IPClient()
+        self.cache = CacheLayer()
+        self.ip_client = IPClient(max_workers=self.max_workers, cache=self.cache, session=self.session)
 
         if self.user_together_ai:
-            self.togehter_client = TogetherClient(api_key=credentials['TOGETHER_API_KEY'])
+            self.togehter_client = TogetherClient(api_key=credentials['TOGETHER_API_KEY'], cache=self.cache)
             together_connected = self.togehter_client.connect()
             initialized = 1 if together_connected else 0
         if self.use_gemini_ai:
-            self.gemini_client = GeminiClient(api_key=credentials["GEMINI_API_KEY"])
+            self.gemini_client = GeminiClient(api_key=credentials["GEMINI_API_KEY"], cache=self.cache)
             gemini_connect =self.gemini_client.connect()
             initialized = 1 if gemini_connect else 0
         self.csv_handler = CSVHandler()
 
         
         if initialized == 0:
-            self.logger.error("Failed to initialize AI")
+            logger.error("Failed to initialize AI")
             return False
         
         return True
     
 
-    def process_single_ip(self, network_record: List) -> Dict:
+    def process_single_ip(self, network_record: List, ip_data: Optional[Dict] = None) -> Dict:
         """Process a single IP address through both APIs."""
-        # Get IP data
-        ip_data = self.ip_client.get_ip_details(network_record[0])
-        network_dict = {
-            "ip" : network_record[0],
-            "total events" : network_record[1],
-            "connects" : network_record[2],
-            "disconnects" : network_record[3],
-            "sends" : network_record[4],
-            "receives" : network_record[5],
-            "send bytes" : network_record[6],
-            "received bytes" : network_record[7],
-            "country": ip_data.get("country"),
-            "organisation": ip_data.get("org"),
-            "isp": ip_data.get("isp")
-        }
+        skipped = self._skip_non_public(network_record)
+        if skipped is not None:
+            return skipped
+        ip_details = {network_record[0]: ip_data} if ip_data is not None else {}
+        return self.process_ip_batch([network_record], ip_details)[0]
+
+    def process_ip_batch(self, network_records: List[List], ip_details: Dict[str, Dict]) -> List[Dict]:
+        """Analyze a batch of IP addresses with a single AI request where supported."""
+        # Get IP data for any IP that was not resolved in the ip-api batch
+        ip_data_list = [ip_details.get(network_record[0]) or self.ip_client.get_ip_details(network_record[0]) or {}
+                        for network_record in network_records]
+        # Host names that ip-api.com resolved to a private or reserved address,
+        # or could not resolve, are not sent to the AI model
+        results = [self._skip_failed_lookup(network_record, ip_data)
+                   for network_record, ip_data in zip(network_records, ip_data_list)]
+        analysis_requests = [
+            dict(zip(_ANALYSIS_ARGS, network_record), ip_data=ip_data)
+            for network_record, ip_data, result in zip(network_records, ip_data_list, results)
+            if result is None
+        ]
         if self.use_gemini_ai:
-            final_data = self.gemini_client.analyze_ip_data(ip_data=ip_data, ip=network_record[0], total_events=network_record[1], connects=network_record[2], disconnects=network_record[3], sends=network_record[4], receives=network_record[5], send_bytes=network_record[6], receive_bytes=network_record[7])
-        
+            analyses = self.gemini_client.analyze_ip_batch(analysis_requests)
+
         if self.user_together_ai:
-            final_data = self.togehter_client.analyze_ip_data(ip_data=ip_data, ip=network_record[0], total_events=network_record[1], connects=network_record[2], disconnects=network_record[3], sends=network_record[4], receives=network_record[5], send_bytes=network_record[6], receive_bytes=network_record[7])
+            analyses = self.togehter_client.analyze_ip_batch(analysis_requests)
 
-        merged_dict = network_dict.copy()
-        merged_dict.update(final_data)
-        time.sleep(15)
-        return merged_dict
+        analyses = iter(analyses)
+        return [result if result is not None else self._merge_result(network_record, ip_data, next(analyses))
+                for network_record, ip_data, result in zip(network_records, ip_data_list, results)]
 
-    def process_ip_list(self, netwok_summary_list: List[List[str]], max_workers: int = 3) -> List[Dict]:
-        """Process a list of IPs concurrently."""
-        # Progress tracing
-        done = 0
-        progress_tracker(len(netwok_summary_list), done)
+    def _skip_non_public(self, network_record: List) -> Optional[Dict]:
+        """
+        Build the result for IPs that should not be sent to the APIs.
 
+        Host names are passed through so ip-api.com can resolve them.
+
+        Returns:
+            Result row for invalid or non-public IPs, None if the IP should be analyzed
+        """
+        try:
+            address = ipaddress.ip_address(network_record[0])
+        except ValueError:
+            if _HOSTNAME_RE.fullmatch(network_record[0]):
+                return None
+            return self._merge_result(network_record, {}, {"error": "invalid"})
+        if not address.is_global:
+            return self._merge_result(network_record, {}, {"classification": "private"})
+        return None
+
+    def _skip_failed_lookup(self, network_record: List, ip_data: Dict) -> Optional[Dict]:
+        """
+        Build the result for IPs that ip-api.com rejected.
+
+        Returns:
+            Result row for private, reserved or invalid queries, None if the IP should be analyzed
+        """
+        if ip_data.get("status") != "fail":
+            return None
+        message = ip_data.get("message")
+        if message in ("private range", "reserved range"):
+            return self._merge_result(network_record, ip_data, {"classification": "private"})
+        if message == "invalid query":
+            return self._merge_result(network_record, ip_data, {"error": "invalid"})
+        return None
+
+    def _merge_result(self, network_record: List, ip_data: Dict, final_data: Optional[Dict]) -> Dict:
+        """Combine the network metrics, IP details and AI analysis into one row."""
+        network_dict = _base_dict(network_record)
+        network_dict["country"] = ip_data.get("country")
+        network_dict["organisation"] = ip_data.get("org")
+        network_dict["isp"] = ip_data.get("isp")
+        return network_dict | (final_data or {"error": "AI analysis failed"})
+
+    def process_ip_list(self, netwok_summary_list: List[List[str]]) -> List[Dict]:
+        """Process a list of IPs concurrently."""
         # Actual function
         results = []
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_ip = {executor.submit(self.process_single_ip, network_record): network_record 
-                          for network_record in netwok_summary_list}
-            
-            for future in as_completed(future_to_ip):
-                network_record = future_to_ip[future]
-                try:
-                    result = future.result()
-                    results.append(result)
-                    self.logger.info(f"Completed analysis for IP: {network_record}")
-                except Exception as e:
-                    self.logger.error(f"Error processing IP {network_record}: {str(e)}")
-                    network_dict = {
-                    "ip" : network_record[0],
-                    "total events" : network_record[1],
-                    "connects" : network_record[2],
-                    "disconnects" : network_record[3],
-                    "sends" : network_record[4],
-                    "receives" : network_record[5],
-                    "send bytes" : network_record[6],
-                    "received bytes" : network_record[7],
-                    "error": str(e).replace(",", "-"),
-                    }
+        # Merge duplicate IPs so each one is only analyzed once
+        netwok_summary_list = aggregate_network_records(netwok_summary_list)
+        # Private, loopback and malformed addresses never need an API call
+        public_records = []
+        for network_record in netwok_summary_list:
+            skipped = self._skip_non_public(network_record)
+            if skipped is None:
+                public_records.append(network_record)
+            else:
+                results.append(skipped)
+        done = len(results)
+        progress_tracker(len(netwok_summary_list), done)
+
+        # Look up IP details in batches and queue the AI analysis as soon as
+        # each batch arrives, so lookups overlap with analysis of earlier batches
+        future_to_records = {}
+        for chunk in chunked(public_records, BATCH_SIZE):
+            # The batch endpoint only takes IP addresses, host names are looked up one by one
+            ip_details = self.ip_client.get_ip_details_batch([network_record[0] for network_record in chunk
+                                                              if not _HOSTNAME_RE.fullmatch(network_record[0])])
+            for ai_chunk in chunked(chunk, self.ai_batch_size):
+                future = self.executor.submit(self.process_ip_batch, ai_chunk, ip_details)
+                future_to_records[future] = ai_chunk
+
+        for future in as_completed(future_to_records):
+            network_records = future_to_records[future]
+            try:
+                results.extend(future.result())
+                logger.info(f"Completed analysis for IPs: {[network_record[0] for network_record in network_records]}")
+            except Exception as e:
+                logger.error(f"Error processing IPs {[network_record[0] for network_record in network_records]}: {str(e)}")
+                error = str(e).replace(",", "-")
+                for network_record in network_records:
+                    network_dict = _base_dict(network_record)
+                    network_dict["error"] = error
                     results.append(network_dict)
-                done += 1
-                progress_tracker(len(netwok_summary_list), done)
-        
+            done += len(network_records)
+            progress_tracker(len(netwok_summary_list), done)
+
         return results
 
     def run_analysis(self, input_filename: str) -> str:
@@ -130,22 +203,40 @@ class IPIntelAnalyzer:
         try:
             # Read IPs from CSV
             network_summary = self.csv_handler.read_network_summary(input_filename)
-            self.logger.info(f"Processing {len(network_summary)} IP addresses")
+            logger.info(f"Processing {len(network_summary)} IP addresses")
 
             # Process IPs
             results = self.process_ip_list(network_summary)
 
             # Write results to CSV
             output_file = self.csv_handler.write_analysis_results(results)
-            self.logger.info(f"Analysis complete. Results written to {output_file}")
+            logger.info(f"Analysis complete. Results written to {output_file}")
+            logger.info(f"Cache stats: {self.cache.stats()}")
 
             return output_file
 
         except Exception as e:
-            self.logger.error(f"Error in analysis pipeline: {str(e)}")
+            logger.error(f"Error in analysis pipeline: {str(e)}")
             raise
 
+    def close(self) -> None:
+        """Shut down the worker pool and release pooled connections."""
+        if self.closed:
+            return
+        self.closed = True
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        if getattr(self, 'cache', None) is not None:
+            self.cache.close()
+
+    def __del__(self):
+        self.close()
+
 def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
     model_to_use = str(input("""
     WHich AI Model do you want to user? 
     1. Gemini
@@ -174,6 +265,8 @@ def main():
         print(f"\nAnalysis complete! Results saved to: {output_file}")
     except Exception as e:
         print(f"Error during analysis: {str(e)}")
+    finally:
+        analyzer.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,102 @@
+import functools
+import logging
+import random
+import threading
+import time
+from typing import Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_rate: float):
+        """
+        Initialize a thread-safe token bucket.
+
+        Args:
+            capacity: Maximum number of tokens the bucket holds (burst size)
+            refill_rate: Number of tokens added per second
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, quota: int, burst: int = 1) -> 'TokenBucket':
+        """
+        Create a bucket that never exceeds a per-minute quota.
+
+        Any 60 second window can see at most capacity + 60 * refill_rate
+        requests, so the refill rate is reduced by the burst size to keep
+        that sum within the quota.
+
+        Args:
+            quota: Maximum number of requests allowed per minute
+            burst: Number of requests that may be sent back to back
+        """
+        return cls(capacity=burst, refill_rate=(quota - burst) / 60)
+
+    def acquire(self, tokens: float = 1) -> None:
+        """
+        Block until the requested number of tokens is available, then take them.
+
+        Args:
+            tokens: Number of tokens to take
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.refill_rate
+            time.sleep(wait)
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Read the Retry-After header (in seconds) from an API error, if present."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_with_backoff(retry_on: Tuple[Type[BaseException], ...], max_attempts: int = 5,
+                       base_delay: float = 1.0, max_delay: float = 30.0, jitter: float = 1.0):
+    """
+    Retry a function on transient errors with exponential backoff and jitter.
+
+    The Retry-After header of the error is used instead of the backoff delay
+    when the upstream provides one.
+
+    Args:
+        retry_on: Exception types that trigger a retry
+        max_attempts: Total number of attempts before the error is raised
+        base_delay: Delay in seconds before the first retry
+        max_delay: Upper bound for the backoff delay
+        jitter: Maximum random seconds added to each delay
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    return func(*args, **kwargs)
+                except retry_on as e:
+                    if attempt == max_attempts:
+                        raise
+                    delay = _retry_after(e)
+                    if delay is None:
+                        delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+                    delay += random.uniform(0, jitter)
+                    logger.warning(f"{func.__qualname__} failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+        return wrapper
+    return decorator
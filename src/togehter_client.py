@@ -1,186 +1,222 @@
 import logging
+import re
+from functools import lru_cache
+import httpx
 import together
-from typing import Dict, Optional
+from together import APIConnectionError, APITimeoutError, RateLimitError
+from typing import Dict, List, Optional
+from rate_limiter import TokenBucket, retry_with_backoff
+from cache import CacheLayer
+from ai_common import analyze_record, cached_batch, format_batch_records
+from utils import MAX_TOKENS_PER_IP, parse_analysis
+
+logger = logging.getLogger(__name__)
+
+# Text-only model; the assessment needs no vision capability
+MODEL = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo"
+# IPs per request; free-text assessments are split less reliably in larger batches
+BATCH_SIZE = 10
+
+# Static instructions sent as the system message. Kept identical across calls
+# so the provider can reuse the cached prompt prefix.
+_SYSTEM_PROMPT = """
+You are an expert Cybersecurity Analyst specializing in network behavior analysis and threat detection.
+
+You will receive one or more IP addresses with their IP information in JSON and event metrics.
+
+ANALYSIS REQUIREMENTS:
+Provide a security assessment for each IP address in the following strict format:
+IP: <the IP address>
+Trustworthiness: <insert score 1-100>
+Primary Purpose: <single line description maximum 20 words. no special characters><.>
+Security Concerns: <start with YES or NO><.><space><insert explanation maximum 15 words no special characters><.>
+Risk Score: <insert score 1-100>
+Recommendation: <start with either 'No action required' or 'Requires Attention'><.><space><if attention needed add maximum 20 words no special characters><.>
+
+When several IP addresses are given, provide the assessments in the same order
+and separate them with a line containing only ---
+
+CRITICAL FORMAT RULES:
+1. Do not use any commas periods or special characters
+2. Each field must be on a new line
+3. Use exact field names as shown above
+4. Keep all responses within specified word limits
+5. Maintain consistent capitalization of field names
+6. Use hyphens instead of commas or periods for separation
+7. Ensure each field has exactly one colon followed by a space
+8. Do not include any additional formatting or explanations
+
+ANALYSIS GUIDELINES:
+- Base Trustworthiness score on:
+* Known IP reputation
+* Organisaton and ISP result
+* Communication patterns
+* Data volume ratios
+* Connection frequency
+- Consider these risk factors:
+* Unusual port usage
+* Asymmetric data transfer
+* Connection pattern anomalies
+* Geographic location concerns
+
+Your response must be directly parseable by the following format indicators:
+- Line starts with field name followed by colon
+- Single space after colon
+- No line breaks within fields
+- No extra whitespace
+- No additional formatting
+""".strip()
+
+_PROMPT_TEMPLATE = """
+- Full IP Information in JSON: {ip_text}
+- IP Address: {ip}
+- Event Metrics:
+* Total Events: {total_events}
+* Connection Events: {connects} connects | {disconnects} disconnects
+* Data Transfer: {sends} sends ({send_bytes} bytes) | {receives} receives ({receive_bytes} bytes)
+* Derived: {bytes_per_event} bytes per event | {connect_ratio} connects per disconnect | {send_receive_asymmetry} send/receive asymmetry (-1 receive only, 1 send only)
+""".strip()
+
+_BATCH_PROMPT_TEMPLATE = """
+{count} IP addresses:
+{records}
+""".strip()
+
+# Assessments are split on '---' lines and before every 'IP:' line, so a
+# response without separators still yields one block per IP
+_BLOCK_SPLIT_RE = re.compile(r'^[ \t]*-{3,}[ \t]*$|^(?=[ \t*#-]*IP[ \t*]*:)', re.IGNORECASE | re.MULTILINE)
+_IP_LINE_RE = re.compile(r'^[ \t*#-]*IP[ \t*]*:[ \t*]*(\S+?)[ \t*]*$', re.IGNORECASE | re.MULTILINE)
+
+@lru_cache(maxsize=4)
+def _get_client(api_key: str) -> together.Together:
+    """
+    Create the Together SDK client once per API key so it is reused across clients.
+
+    The client gets a connection pool large enough for all worker threads to
+    keep a warm keep-alive connection instead of waiting on the default pool.
+    SDK retries are disabled so retry_with_backoff, which goes through the
+    rate limiter, is the only retry layer.
+    """
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        timeout=60
+    )
+    return together.Together(api_key=api_key, http_client=http_client, max_retries=0)
 
 class TogetherClient:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache: Optional[CacheLayer] = None):
         """
         Initialize Together AI client.
         
         Args:
             api_key: Togehter API key
+            cache: Optional response cache
         """
         self.api_key = api_key
+        self.cache = cache
         self.client = None
-        self.setup_logging()
-
-
-    def setup_logging(self):
-        """Configure logging for the Togehter client."""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        self.logger = logging.getLogger('TogetherClient')
+        # Together free tier allows 60 requests per minute
+        self.rate_limiter = TokenBucket.per_minute(60)
 
     def connect(self) -> bool:
         """Establish connection to Together API."""
         try:
-            self.client = together.Together(api_key=self.api_key)
+            self.client = _get_client(self.api_key)
             return True
         except Exception as e:
-            self.logger.error(f"Failed to connect to Together API: {str(e)}")
+            logger.error(f"Failed to connect to Together API: {str(e)}")
             return False
 
-    def analyze_ip_data(self, ip_data: Dict, ip, total_events: int = None, connects: int = None, disconnects: int = None, sends: int = None, receives: int = None, send_bytes: int = None, receive_bytes: int = None) -> Optional[Dict]:
+    def analyze_ip_batch(self, records: List[Dict]) -> List[Optional[Dict]]:
         """
-        Analyze IP data using Together AI.
-        
+        Analyze several IPs with a single Together request.
+
         Args:
-            ip_data: Dictionary containing IP information from Censys
-            
+            records: Analysis requests (ip, ip_data and event metrics), one dictionary per IP
+
         Returns:
-            Dictionary containing AI analysis results
+            List of AI analysis results in the same order as records
         """
-        try:
-            # Format the IP data for analysis
-            ip_text = ip_data.__str__()
-            prompt = f"""
-            You are an expert Cybersecurity Analyst specializing in network behavior analysis and threat detection.
-
-            INPUT DATA:
-            - Full IP Information in JSON: {ip_text}
-            - IP Address: {ip}
-            - Event Metrics:
-            * Total Events: {total_events}
-            * Connection Events: {connects} connects | {disconnects} disconnects
-            * Data Transfer: {sends} sends ({send_bytes} bytes) | {receives} receives ({receive_bytes} bytes)
-
-            ANALYSIS REQUIREMENTS:
-            Provide a security assessment in the following strict format:
-            IP: {ip}
-            Trustworthiness: <insert score 1-100>
-            Primary Purpose: <single line description maximum 20 words. no special characters><.>
-            Security Concerns: <start with YES or NO><.><space><insert explanation maximum 15 words no special characters><.>
-            Risk Score: <insert score 1-100>
-            Recommendation: <start with either 'No action required' or 'Requires Attention'><.><space><if attention needed add maximum 20 words no special characters><.>
-
-            CRITICAL FORMAT RULES:
-            1. Do not use any commas periods or special characters
-            2. Each field must be on a new line
-            3. Use exact field names as shown above
-            4. Keep all responses within specified word limits
-            5. Maintain consistent capitalization of field names
-            6. Use hyphens instead of commas or periods for separation
-            7. Ensure each field has exactly one colon followed by a space
-            8. Do not include any additional formatting or explanations
-
-            ANALYSIS GUIDELINES:
-            - Base Trustworthiness score on:
-            * Known IP reputation
-            * Organisaton and ISP result
-            * Communication patterns
-            * Data volume ratios
-            * Connection frequency
-            - Consider these risk factors:
-            * Unusual port usage
-            * Asymmetric data transfer
-            * Connection pattern anomalies
-            * Geographic location concerns
-
-            Your response must be directly parseable by the following format indicators:
-            - Line starts with field name followed by colon
-            - Single space after colon
-            - No line breaks within fields
-            - No extra whitespace
-            - No additional formatting
-            """
-       
-            # Get Together's analysis
-            response = self.client.chat.completions.create(
-                model="meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo",
-                messages=[
-                    {
-                            "role": "user",
-                            "content": [
-                                    {
-                                            "type": "text",
-                                            "text": prompt
-                                    }
-                            ]
-                    }
-
-                ],
-                max_tokens=300,
-                temperature=0.9,
-                top_p=0.2,
-                top_k=40,
-                repetition_penalty=1,
-                stop=["<|eot_id|>","<|eom_id|>"],
-                stream=True
-            )
-            # Extract the analysis from Together's response
-            analysis = ""
-            for chunk in response:
-                if hasattr(chunk, 'choices'):
-                    try:
-                        analysis +=  chunk.choices[0].delta.content
-                    except Exception:
-                        analysis += ""
-
-            print(analysis)
-
-            # Parse the analysis into structured fields
-            analysis_dict = self._parse_analysis(analysis)
-        
+        return cached_batch(self.cache, "together", records, self._analyze_batch, self._analyze_record)
 
-            return analysis_dict
+    def _analyze_record(self, record: Dict) -> Optional[Dict]:
+        """Analyze one IP without the cache."""
+        return analyze_record(record, _PROMPT_TEMPLATE, self._generate)
 
-        except Exception as e:
-            self.logger.error(f"Error analyzing IP {ip_data['ip']}: {str(e)}")
-            return None
+    def _analyze_batch(self, records: List[Dict]) -> Dict[str, Dict]:
+        """
+        Send several IPs in one request and parse the assessments.
 
-    def _parse_analysis(self, analysis: str) -> Dict:
+        Returns:
+            Dictionary mapping each IP to its analysis fields
         """
-        Parse Together's analysis into structured fields.
-        
+        prompt = _BATCH_PROMPT_TEMPLATE.format_map({'count': len(records), 'records': format_batch_records(records)})
+        analysis = self._generate(prompt, max_tokens=MAX_TOKENS_PER_IP * len(records))
+        logger.debug("Together batch analysis: %s", analysis)
+        return self._parse_batch_analysis(analysis, [record['ip'] for record in records])
+
+    def _parse_batch_analysis(self, analysis: str, ips: List[str]) -> Dict[str, Dict]:
+        """
+        Split a batch response into assessments and parse each one.
+
+        Assessments that are missing a field, for example because the
+        response was cut off, or that claim an IP already seen are dropped
+        so those IPs fall back to a single-IP request.
+
         Args:
             analysis: Raw analysis text from Together
-            
+            ips: IP addresses in the order they were sent
+
         Returns:
-            Dictionary containing parsed analysis fields
+            Dictionary mapping each IP to its parsed analysis fields
+        """
+        blocks = []
+        for block in _BLOCK_SPLIT_RE.split(analysis):
+            parsed = parse_analysis(block)
+            # Skip separators and any preamble before the first assessment
+            if any(parsed.values()):
+                match = _IP_LINE_RE.search(block)
+                blocks.append((match.group(1) if match else None, parsed))
+
+        analyses = {}
+        duplicates = set()
+        for position, (ip, parsed) in enumerate(blocks):
+            if ip is None and len(blocks) == len(ips):
+                ip = ips[position]
+            if ip not in ips or not all(parsed.values()):
+                continue
+            if ip in analyses:
+                duplicates.add(ip)
+            analyses[ip] = parsed
+        for ip in duplicates:
+            del analyses[ip]
+        return analyses
+
+    @retry_with_backoff((RateLimitError, APITimeoutError, APIConnectionError))
+    def _generate(self, prompt: str, max_tokens: int = MAX_TOKENS_PER_IP) -> str:
         """
-        # Initialize default values
-        parsed = {
-            'trustworthiness': '',
-            'primary_purpose': '',
-            'security_concerns': '',
-            'risk score': '',
-            'recommendation': ''
-        }
-
-        # Simple parsing based on field markers
-        current_field = None
-        for line in analysis.split('\n'):
-            line = line.strip()
-            lower_line = line.lower()
-
-            if 'trustworthiness' in lower_line and ':' in line:
-                current_field = 'trustworthiness'
-                parsed[current_field] = line.split(':', 1)[1].strip()
-            elif 'primary purpose' in lower_line and ':' in line:
-                current_field = 'primary_purpose'
-                parsed[current_field] = line.split(':', 1)[1].strip()
-            elif 'security concerns' in lower_line and ':' in line:
-                current_field = 'security_concerns'
-                parsed[current_field] = line.split(':', 1)[1].strip()
-            elif 'risk score' in lower_line and ':' in line:
-                current_field = 'risk score'
-                parsed[current_field] = line.split(':', 1)[1].strip()
-            elif 'recommendation' in lower_line and ':' in line:
-                current_field = 'recommendation'
-                parsed[current_field] = line.split(':', 1)[1].strip()
-            elif current_field and line:
-                parsed[current_field] += ' ' + line
-
-        return parsed
\ No newline at end of file
+        Send a prompt to Together, retrying on rate limits and connection errors.
+
+        The static instructions go in the system message and only the
+        per-IP data in the user message, which is placed last. Sampling is
+        greedy so identical inputs give identical, cacheable output.
+
+        Args:
+            prompt: Per-IP user message
+            max_tokens: Maximum number of tokens to generate
+        """
+        self.rate_limiter.acquire()
+        response = self.client.chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": _SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            temperature=0.0,
+            top_p=1.0,
+            repetition_penalty=1,
+            stop=["<|eot_id|>","<|eom_id|>"],
+            stream=False
+        )
+        return response.choices[0].message.content or ""
\ No newline at end of file
@@ -1,3 +1,107 @@
+import json
+import re
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Matches "Field: value" lines in the AI analysis, tolerating markdown bullets and bold
+_FIELD_RE = re.compile(
+    r'^[ \t*#-]*(Trustworthiness|Primary[ \t]+Purpose|Security[ \t]+Concerns|Risk[ \t]+Score|Recommendation)'
+    r'[ \t*]*:[ \t*]*(.*?)[ \t]*$',
+    re.IGNORECASE | re.MULTILINE
+)
+_WHITESPACE_RE = re.compile(r'\s+')
+# Field labels of the AI analysis mapped to result keys
+FIELD_MAP = {
+    'trustworthiness': 'trustworthiness',
+    'primary purpose': 'primary_purpose',
+    'security concerns': 'security_concerns',
+    'risk score': 'risk score',
+    'recommendation': 'recommendation'
+}
+
+# Output token budget per IP; an assessment fits in well under 100 tokens
+MAX_TOKENS_PER_IP = 128
+
+# ip-api.com fields that are relevant to the AI analysis
+IP_DATA_FIELDS = ('query', 'country', 'regionName', 'city', 'isp', 'org', 'as')
+
+# Minimum seconds between progress lines, at most 10 updates per second
+_PROGRESS_INTERVAL = 0.1
+_last_progress = 0.0
+
+
 def progress_tracker(total:int, done:int):
-    persentage_done = round(done/total*100, 2)
-    print(f"{str(done)} out of {str(total)} done. Completed: {persentage_done}%")
\ No newline at end of file
+    """Print progress, skipping updates that come too quickly. The final update is always printed."""
+    global _last_progress
+    now = time.monotonic()
+    if done < total and now - _last_progress < _PROGRESS_INTERVAL:
+        return
+    _last_progress = now
+    persentage_done = round(done/total*100, 2) if total else 100.0
+    print(f"{str(done)} out of {str(total)} done. Completed: {persentage_done}%")
+
+
+def aggregate_network_records(network_records: Iterable[List]) -> List[List]:
+    """
+    Merge network records for the same IP, summing their event metrics.
+
+    Args:
+        network_records: Records of [ip, total_events, connects, disconnects, sends, receives, send_bytes, receive_bytes]
+
+    Returns:
+        One record per unique IP, in order of first appearance
+    """
+    summary = {}
+    for network_record in network_records:
+        ip = network_record[0]
+        totals = summary.get(ip)
+        if totals is None:
+            summary[ip] = [ip] + [int(value) for value in network_record[1:8]]
+        else:
+            for i in range(1, 8):
+                totals[i] += int(network_record[i])
+    return list(summary.values())
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """Yield successive lists of at most `size` items."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+
+def parse_analysis(analysis: str) -> Dict[str, str]:
+    """
+    Parse the AI analysis into structured fields.
+
+    Args:
+        analysis: Raw analysis text from the AI model
+
+    Returns:
+        Dictionary containing parsed analysis fields
+    """
+    parsed = dict.fromkeys(FIELD_MAP.values(), '')
+    matches = list(_FIELD_RE.finditer(analysis))
+    for i, match in enumerate(matches):
+        field = FIELD_MAP[_WHITESPACE_RE.sub(' ', match.group(1).lower())]
+        # Lines between this field and the next one continue the value
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(analysis)
+        continuation = _WHITESPACE_RE.sub(' ', analysis[match.end():end]).strip()
+        parsed[field] = f"{match.group(2)} {continuation}".strip()
+    return parsed
+
+
+def compact_ip_data(ip_data: Optional[Dict]) -> str:
+    """
+    Serialize the relevant ip-api.com fields as compact JSON for AI prompts.
+
+    Args:
+        ip_data: Dictionary containing IP information from ip-api.com
+
+    Returns:
+        JSON string without whitespace
+    """
+    fields = {key: ip_data[key] for key in IP_DATA_FIELDS if key in ip_data} if ip_data else {}
+    return json.dumps(fields, separators=(',', ':'))